@@ -1,10 +1,13 @@
 """
 聊天会话管理服务
 """
+from sqlalchemy import func, and_, insert, update
 from sqlalchemy.orm import Session
-from database import ChatSession, ChatMessage, get_db
+from database import ChatSession, ChatMessage, get_db, generate_uuid
 from typing import List, Optional, Dict
-from datetime import datetime
+
+# 会话列表中最后一条消息的预览长度
+MESSAGE_PREVIEW_LENGTH = 50
 
 
 def create_chat_session(db: Session, title: str, user_id: Optional[str] = None) -> ChatSession:
@@ -19,8 +22,8 @@ def create_chat_session(db: Session, title: str, user_id: Optional[str] = None)
     return session
 
 
-def get_chat_sessions(db: Session, user_id: Optional[str] = None, limit: int = 50) -> List[Dict]:
-    """获取聊天会话列表"""
+def get_chat_sessions(db: Session, user_id: Optional[str] = None, limit: int = 50, offset: int = 0) -> List[Dict]:
+    """获取聊天会话列表（仅返回最后一条消息预览，完整消息通过 get_chat_session 获取）"""
     query = db.query(ChatSession)
     
     # 如果指定了用户ID，则过滤
@@ -30,16 +33,38 @@ def get_chat_sessions(db: Session, user_id: Optional[str] = None, limit: int = 5
         # 暂时获取所有会话
         pass
     
-    sessions = query.order_by(ChatSession.updated_at.desc()).limit(limit).all()
+    sessions = query.order_by(ChatSession.updated_at.desc()).offset(offset).limit(limit).all()
+    
+    # 一次查询取出本页每个会话的最后一条消息
+    last_messages = {}
+    session_ids = [session.id for session in sessions]
+    if session_ids:
+        latest = db.query(
+            ChatMessage.session_id,
+            func.max(ChatMessage.sequence).label("max_sequence")
+        ).filter(
+            ChatMessage.session_id.in_(session_ids)
+        ).group_by(ChatMessage.session_id).subquery()
+        
+        rows = db.query(ChatMessage).join(
+            latest,
+            and_(
+                ChatMessage.session_id == latest.c.session_id,
+                ChatMessage.sequence == latest.c.max_sequence
+            )
+        ).all()
+        for msg in rows:
+            preview = msg.to_dict()
+            if len(preview["text"]) > MESSAGE_PREVIEW_LENGTH:
+                preview["text"] = preview["text"][:MESSAGE_PREVIEW_LENGTH] + "..."
+            last_messages[msg.session_id] = preview
     
-    # 返回会话及其消息
     result = []
     for session in sessions:
-        messages = get_chat_messages(db, session.id)
         result.append({
             "id": session.id,
             "title": session.title,
-            "messages": messages,
+            "last_message": last_messages.get(session.id),
             "created_at": session.created_at.isoformat() if session.created_at else None,
             "updated_at": session.updated_at.isoformat() if session.updated_at else None
         })
@@ -65,34 +90,94 @@ def get_chat_session(db: Session, session_id: str) -> Optional[Dict]:
     }
 
 
+def _lock_session(db: Session, session_id: str) -> None:
+    """
+    更新会话的更新时间，并借此锁住会话，串行化同一会话的序号分配
+    
+    必须在读取最大序号之前执行：该 UPDATE 持有会话行锁（SQLite 下为写锁）直到提交，
+    并发写入同一会话的请求会在此等待，不会读到相同的最大序号
+    """
+    db.execute(
+        update(ChatSession).where(ChatSession.id == session_id).values(updated_at=func.now())
+    )
+
+
 def add_chat_message(db: Session, session_id: str, role: str, content: str) -> ChatMessage:
     """添加聊天消息"""
-    # 获取当前会话的消息数量，用于设置顺序
-    message_count = db.query(ChatMessage).filter(ChatMessage.session_id == session_id).count()
+    _lock_session(db, session_id)
+    
+    # 取当前最大序号 + 1 作为新消息顺序（走 session_id+sequence 索引，无需 COUNT 扫描）
+    next_sequence = db.query(
+        func.coalesce(func.max(ChatMessage.sequence), -1) + 1
+    ).filter(ChatMessage.session_id == session_id).scalar()
     
     message = ChatMessage(
         session_id=session_id,
         role=role,
         content=content,
-        sequence=message_count
+        sequence=next_sequence
     )
     db.add(message)
-    
-    # 更新会话的更新时间
-    session = db.query(ChatSession).filter(ChatSession.id == session_id).first()
-    if session:
-        session.updated_at = datetime.now()
-    
     db.commit()
     db.refresh(message)
     return message
 
 
-def get_chat_messages(db: Session, session_id: str) -> List[Dict]:
-    """获取聊天会话的所有消息"""
-    messages = db.query(ChatMessage).filter(
-        ChatMessage.session_id == session_id
-    ).order_by(ChatMessage.sequence).all()
+def add_chat_messages_bulk(db: Session, session_id: str, messages: List[Dict]) -> int:
+    """
+    批量添加聊天消息（用于导入/同步历史记录）
+    
+    Args:
+        messages: [{"role": "user"/"bot", "content": "..."}]，按顺序排列
+        
+    Returns:
+        写入的消息数量
+    """
+    if not messages:
+        return 0
+    
+    _lock_session(db, session_id)
+    
+    base_sequence = db.query(
+        func.coalesce(func.max(ChatMessage.sequence), -1) + 1
+    ).filter(ChatMessage.session_id == session_id).scalar()
+    
+    rows = [{
+        "id": generate_uuid(),
+        "session_id": session_id,
+        "role": msg["role"],
+        "content": msg["content"],
+        "sequence": base_sequence + i
+    } for i, msg in enumerate(messages)]
+    
+    # 单条 INSERT ... VALUES 多行写入，一次提交
+    db.execute(insert(ChatMessage), rows)
+    db.commit()
+    return len(rows)
+
+
+def get_chat_messages(
+    db: Session,
+    session_id: str,
+    after_sequence: Optional[int] = None,
+    limit: Optional[int] = None
+) -> List[Dict]:
+    """
+    获取聊天会话的消息
+    
+    按 sequence 做游标分页：传入上一页最后一条消息的 sequence 作为 after_sequence，
+    limit 为空时返回全部消息
+    """
+    query = db.query(ChatMessage).filter(ChatMessage.session_id == session_id)
+    
+    if after_sequence is not None:
+        query = query.filter(ChatMessage.sequence > after_sequence)
+    
+    query = query.order_by(ChatMessage.sequence)
+    if limit:
+        query = query.limit(limit)
+    
+    messages = query.all()
     
     return [msg.to_dict() for msg in messages]
 
@@ -117,7 +202,7 @@ def update_chat_session_title(db: Session, session_id: str, title: str) -> bool:
         return False
     
     session.title = title
-    session.updated_at = datetime.now()
+    session.updated_at = func.now()
     db.commit()
     return True
 
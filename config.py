@@ -16,6 +16,7 @@ LOG_FILE_NAME = f'./log/hr_kb_log_{datetime.now().strftime("%Y%m%d")}.log'
 # ChromaDB配置
 CHROMA_DB_PATH = "./chroma_db"
 CHROMA_COLLECTION_NAME = "hr_knowledge"
+CHROMA_ADD_BATCH_SIZE = 128  # 每次写入ChromaDB的文档块数量（不超过客户端上报的最大批量）
 
 # Ollama配置
 OLLAMA_BASE_URL = "http://localhost:11434"
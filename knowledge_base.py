@@ -1,78 +1,226 @@
+import array
+import asyncio
 import tempfile
 import os
+import hashlib
+import uuid
+import itertools
+from collections import OrderedDict
+import shutil
+import threading
 import mimetypes
+from functools import cache, lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Tuple, Optional
+from charset_normalizer import from_bytes as charset_from_bytes, from_path as charset_from_path
 from fastapi import UploadFile, HTTPException
-from langchain_community.document_loaders import PyPDFLoader, TextLoader, Docx2txtLoader, UnstructuredPDFLoader
+from langchain_community.document_loaders import PyPDFLoader, TextLoader, Docx2txtLoader
+from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from logging_setup import logger
-from config import MAX_FILE_SIZE, SUPPORTED_FORMATS
+try:
+    import pypdfium2 as pdfium
+except ImportError:  # 未安装时退回PyPDFLoader
+    pdfium = None
+from config import MAX_FILE_SIZE, SUPPORTED_FORMATS, CHROMA_ADD_BATCH_SIZE
+
+# 无法从客户端获取最大批量时使用的上限（ChromaDB默认SQLite的取值）
+CHROMA_FALLBACK_MAX_BATCH_SIZE = 5461
+
+# 文本向量LRU缓存的最大条目数
+EMBEDDING_CACHE_SIZE = 4096
+
+# 遍历集合元数据时每页读取的chunk数量
+CHROMA_SCAN_PAGE_SIZE = 1000
+
+# 上传文件落盘时的拷贝缓冲区大小
+UPLOAD_COPY_BUFFER_SIZE = 1024 * 1024
 
 chroma_collection = None
+chroma_embedding_function = None
+_chroma_init_lock = threading.Lock()
+
+@cache
+def _get_unstructured_pdf_loader():
+    """按需导入UnstructuredPDFLoader（仅备用PDF处理时使用，依赖较重）"""
+    from langchain_community.document_loaders import UnstructuredPDFLoader
+    return UnstructuredPDFLoader
 
 def init_chroma():
     """初始化ChromaDB向量数据库"""
-    global chroma_collection
+    global chroma_collection, chroma_embedding_function
     if chroma_collection is None:
-        try:
-            import chromadb
-            from chromadb.config import Settings
+        # 双重检查加锁，避免并发请求重复打开ChromaDB
+        with _chroma_init_lock:
+            if chroma_collection is None:
+                try:
+                    import chromadb
+                    from chromadb.config import Settings
+                    from chromadb.utils import embedding_functions
             
-            # 创建设置，明确禁用遥测
-            settings = Settings(
-                anonymized_telemetry=False,
-                allow_reset=True
-            )
+                    # 创建设置，明确禁用遥测
+                    settings = Settings(
+                        anonymized_telemetry=False,
+                        allow_reset=True
+                    )
             
-            # 尝试持久化模式
-            client = chromadb.PersistentClient(
-                path="./chroma_db",
-                settings=settings
-            )
-            logger.info("使用ChromaDB持久化模式")
+                    # 尝试持久化模式
+                    client = chromadb.PersistentClient(
+                        path="./chroma_db",
+                        settings=settings
+                    )
+                    logger.info("使用ChromaDB持久化模式")
             
-            # 获取或创建集合
-            chroma_collection = client.get_or_create_collection(
-                name="hr_knowledge_base",
-                metadata={"description": "人事知识库向量存储"}
-            )
+                    # 显式持有嵌入函数，便于写入前整篇文档一次性向量化
+                    chroma_embedding_function = embedding_functions.DefaultEmbeddingFunction()
+
+                    # 获取或创建集合
+                    chroma_collection = client.get_or_create_collection(
+                        name="hr_knowledge_base",
+                        metadata={"description": "人事知识库向量存储"},
+                        embedding_function=chroma_embedding_function
+                    )
             
-            logger.info("ChromaDB初始化成功")
+                    logger.info("ChromaDB初始化成功")
             
-        except Exception as e:
-            logger.error(f"ChromaDB初始化失败: {e}", exc_info=True)
-            chroma_collection = None
+                except Exception as e:
+                    logger.error(f"ChromaDB初始化失败: {e}", exc_info=True)
+                    chroma_collection = None
             
     return chroma_collection
 
+class SearchResult:
+    """检索结果文档对象（与LangChain Document的page_content/metadata接口一致）"""
+    __slots__ = ('page_content', 'metadata', 'score')
+
+    def __init__(self, page_content, metadata, score):
+        self.page_content = page_content
+        self.metadata = metadata
+        self.score = score
+
 class VectorManager:
     """向量管理器包装类"""
     
-    def __init__(self, collection):
+    def __init__(self, collection, embedding_function=None):
         self.collection = collection
-    
+        self.embedding_function = embedding_function
+        # 文本内容(sha256) -> 向量的LRU缓存（array('f')紧凑存储），重复查询和更新文档时未改动的块不必重新向量化
+        self._embedding_cache = OrderedDict()
+        self._embedding_cache_lock = threading.Lock()
+        self._add_batch_size = self._resolve_add_batch_size()
+        # 集合的距离度量决定距离到相似度分数的换算方式（未配置时ChromaDB默认l2）
+        space = ((getattr(collection, 'metadata', None) or {}).get('hnsw:space') or 'l2')
+        self._distance_scale = 0.5 if space == 'l2' else 1.0
+        # 内存索引：标题 -> document_id，document_id -> chunk ID列表 / 元数据
+        self._title_index = {}
+        self._sha256_index = {}
+        self._doc_chunks = {}
+        self._doc_metadata = {}
+        self._total_chunks = 0
+        self._index_loaded = False
+        # 写入/删除会在工作线程中执行，索引的修改与遍历需加锁
+        self._index_lock = threading.RLock()
+        self._load_index()
+
+    def _resolve_add_batch_size(self):
+        """写入批大小：配置值与ChromaDB客户端允许的最大批量取较小者"""
+        max_batch_size = CHROMA_FALLBACK_MAX_BATCH_SIZE
+        get_max_batch_size = getattr(getattr(self.collection, '_client', None), 'get_max_batch_size', None)
+        if get_max_batch_size:
+            try:
+                max_batch_size = get_max_batch_size()
+            except Exception as e:
+                logger.warning(f"获取ChromaDB最大批量失败，使用默认值: {e}")
+        return max(1, min(CHROMA_ADD_BATCH_SIZE, max_batch_size))
+
+    def _load_index(self):
+        """扫描一次集合元数据，构建内存索引"""
+        if not self.collection:
+            return
+
+        try:
+            for chunk_id, metadata in self._iter_chunk_metadatas():
+                self._index_chunk(chunk_id, metadata)
+            self._index_loaded = True
+            logger.info(f"向量索引加载完成，共 {len(self._doc_metadata)} 个文档")
+        except Exception as e:
+            logger.error(f"加载向量索引失败，回退为按条件查询: {e}")
+
+    def _iter_chunk_metadatas(self, page_size=None):
+        """按页遍历集合中所有chunk的(id, metadata)，避免一次性取回整个集合"""
+        page_size = page_size or CHROMA_SCAN_PAGE_SIZE
+        offset = 0
+        while True:
+            results = self.collection.get(include=['metadatas'], limit=page_size, offset=offset)
+            ids = results.get('ids') or [] if results else []
+            if not ids:
+                return
+            yield from zip(ids, results.get('metadatas') or [])
+            if len(ids) < page_size:
+                return
+            offset += page_size
+
+    def _index_chunk(self, chunk_id, metadata):
+        """将单个chunk登记到内存索引"""
+        # 无document_id的chunk同样计入总数，否则空集合判断会漏掉它们
+        self._total_chunks += 1
+        if not metadata or 'document_id' not in metadata:
+            return
+        doc_id = metadata['document_id']
+        self._doc_chunks.setdefault(doc_id, []).append(chunk_id)
+        if doc_id not in self._doc_metadata:
+            self._doc_metadata[doc_id] = metadata
+            title = metadata.get('title')
+            if title:
+                self._title_index[title] = doc_id
+            file_sha256 = metadata.get('file_sha256')
+            if file_sha256:
+                self._sha256_index[file_sha256] = doc_id
+
+    def _unindex_document(self, document_id):
+        """从内存索引中移除文档"""
+        self._total_chunks -= len(self._doc_chunks.pop(document_id, ()))
+        metadata = self._doc_metadata.pop(document_id, None)
+        title = metadata.get('title') if metadata else None
+        if title and self._title_index.get(title) == document_id:
+            del self._title_index[title]
+        file_sha256 = metadata.get('file_sha256') if metadata else None
+        if file_sha256 and self._sha256_index.get(file_sha256) == document_id:
+            del self._sha256_index[file_sha256]
+
+    def find_document_by_sha256(self, file_sha256):
+        """按文件指纹查找已存在的文档ID，不存在返回None"""
+        if not self.collection:
+            return None
+
+        if self._index_loaded:
+            return self._sha256_index.get(file_sha256)
+
+        try:
+            results = self.collection.get(where={"file_sha256": file_sha256}, limit=1, include=['metadatas'])
+            metadatas = results.get('metadatas') if results else None
+            return metadatas[0].get('document_id') if metadatas else None
+        except Exception as e:
+            logger.error(f"按文件指纹查找文档时出错: {e}")
+            return None
+
     def check_duplicate_title(self, title, exclude_doc_id=None):
         """检查标题是否重复"""
         if not self.collection:
             return False
-            
+
+        if self._index_loaded:
+            doc_id = self._title_index.get(title)
+            return doc_id is not None and doc_id != exclude_doc_id
+
         try:
-            # 查询所有文档的元数据
-            results = self.collection.get(include=['metadatas'])
-            
-            if not results or not results.get('metadatas'):
-                return False
-                
-            # 检查是否有相同标题的文档
-            for i, metadata in enumerate(results['metadatas']):
-                if metadata and metadata.get('title') == title:
-                    # 如果指定了排除的文档ID，跳过该文档
-                    if exclude_doc_id and results.get('ids') and results['ids'][i] == exclude_doc_id:
-                        continue
-                    return True
-                    
-            return False
-            
+            # 标题与排除条件都下推到ChromaDB的元数据过滤，命中一条即可判定重复
+            where = {"title": title}
+            if exclude_doc_id:
+                where = {"$and": [{"title": title}, {"document_id": {"$ne": exclude_doc_id}}]}
+            results = self.collection.get(where=where, limit=1, include=[])
+            return bool(results and results.get('ids'))
+
         except Exception as e:
             logger.error(f"检查重复标题时出错: {e}")
             return False
@@ -85,14 +233,13 @@ class VectorManager:
         # 生成文档ID
         if ids is None:
             if isinstance(texts, list):
-                if document_id:
-                    ids = [f"{document_id}_chunk_{i}" for i in range(len(texts))]
-                else:
-                    import uuid
-                    base_id = str(uuid.uuid4())
-                    ids = [f"{base_id}_chunk_{i}" for i in range(len(texts))]
+                if not document_id:
+                    document_id = str(uuid.uuid4())
+                ids = [f"{document_id}_chunk_{i}" for i in range(len(texts))]
             else:
-                ids = [document_id or str(uuid.uuid4())]
+                if not document_id:
+                    document_id = str(uuid.uuid4())
+                ids = [document_id]
                 texts = [texts]
                 metadatas = [metadatas]
         else:
@@ -101,37 +248,142 @@ class VectorManager:
                 texts = [texts]
             if not isinstance(metadatas, list):
                 metadatas = [metadatas]
-            
+
+        # 确保每个块的元数据都带有document_id，删除和索引都依赖它
+        if document_id:
+            metadatas = [
+                metadata if metadata and 'document_id' in metadata
+                else {**(metadata or {}), 'document_id': document_id}
+                for metadata in metadatas
+            ]
+
         try:
-            self.collection.add(ids=ids, documents=texts, metadatas=metadatas)
+            # 分批写入，避免单次写入过大
+            batch_size = self._add_batch_size
+            bounds = [(start, min(start + batch_size, len(ids))) for start in range(0, len(ids), batch_size)]
+            written = 0
+
+            if self.embedding_function and len(bounds) > 1:
+                # 流水线：写入当前批次的同时，在后台线程向量化下一批次（ONNX推理会释放GIL）
+                with ThreadPoolExecutor(max_workers=1) as executor:
+                    first_start, first_end = bounds[0]
+                    pending = executor.submit(self._embed, texts[first_start:first_end])
+                    for i, (start, end) in enumerate(bounds):
+                        embeddings = pending.result()
+                        if i + 1 < len(bounds):
+                            next_start, next_end = bounds[i + 1]
+                            pending = executor.submit(self._embed, texts[next_start:next_end])
+                        self._add_batch(ids, texts, metadatas, start, end, embeddings)
+                        written = end
+            else:
+                embeddings = self._embed(texts) if self.embedding_function else None
+                for start, end in bounds:
+                    self._add_batch(ids, texts, metadatas, start, end,
+                                    embeddings[start:end] if embeddings is not None else None)
+                    written = end
+
+            with self._index_lock:
+                for chunk_id, metadata in zip(ids, metadatas):
+                    self._index_chunk(chunk_id, metadata)
             return True
         except Exception as e:
             logger.error(f"添加文档时出错: {e}")
+            # 回滚已写入的批次，避免留下只写了一部分的文档
+            if written:
+                try:
+                    self.collection.delete(ids=ids[:written])
+                    logger.warning(f"已回滚 {written} 个已写入的文档块")
+                except Exception as rollback_e:
+                    logger.error(f"回滚已写入的文档块失败: {rollback_e}")
             return False
     
+    def _embed(self, texts):
+        """向量化文本，按内容哈希命中缓存的直接复用，只对未命中的文本调用嵌入函数"""
+        keys = [hashlib.sha256(text.encode('utf-8')).hexdigest() for text in texts]
+        embeddings = [None] * len(texts)
+        missing = []
+        with self._embedding_cache_lock:
+            for i, key in enumerate(keys):
+                cached = self._embedding_cache.get(key)
+                if cached is None:
+                    missing.append(i)
+                else:
+                    self._embedding_cache.move_to_end(key)
+                    embeddings[i] = cached.tolist()
+
+        if missing:
+            computed = self.embedding_function([texts[i] for i in missing])
+            with self._embedding_cache_lock:
+                for i, embedding in zip(missing, computed):
+                    vector = array.array('f', embedding)
+                    embeddings[i] = vector.tolist()
+                    self._embedding_cache[keys[i]] = vector
+                while len(self._embedding_cache) > EMBEDDING_CACHE_SIZE:
+                    self._embedding_cache.popitem(last=False)
+
+        logger.debug("向量化 %d 个文本块，缓存命中 %d 个", len(texts), len(texts) - len(missing))
+        return embeddings
+
+    def _add_batch(self, ids, texts, metadatas, start, end, embeddings):
+        """写入[start, end)范围内的一个批次，失败时重试一次"""
+        logger.debug("写入ChromaDB批次: %d-%d/%d", start, end, len(ids))
+        for attempt in range(2):
+            try:
+                self.collection.add(
+                    ids=ids[start:end],
+                    documents=texts[start:end],
+                    metadatas=metadatas[start:end],
+                    embeddings=embeddings
+                )
+                return
+            except Exception as e:
+                if attempt:
+                    raise
+                logger.warning(f"写入批次 {start}-{end} 失败，重试: {e}")
+
     def delete_document(self, document_id):
         """删除文档"""
         if not self.collection:
             raise Exception("ChromaDB未初始化")
         
         try:
-            # 查找所有相关的chunk
-            results = self.collection.get(include=['metadatas'])
-            if results and results.get('ids'):
-                # 找到所有属于该文档的chunk
-                chunk_ids = []
-                for i, metadata in enumerate(results.get('metadatas', [])):
-                    if metadata and metadata.get('document_id') == document_id:
-                        chunk_ids.append(results['ids'][i])
-                
-                if chunk_ids:
-                    self.collection.delete(ids=chunk_ids)
-                    return True
-            return False
+            if self._index_loaded:
+                with self._index_lock:
+                    chunk_ids = list(self._doc_chunks.get(document_id) or ())
+                if not chunk_ids:
+                    return False
+                self.collection.delete(ids=chunk_ids)
+                with self._index_lock:
+                    self._unindex_document(document_id)
+                return True
+
+            # 无索引时由ChromaDB按document_id过滤删除，只探测一条判断文档是否存在
+            where = {"document_id": document_id}
+            results = self.collection.get(where=where, limit=1, include=[])
+            if not results or not results.get('ids'):
+                return False
+            self.collection.delete(where=where)
+            return True
         except Exception as e:
             logger.error(f"删除文档时出错: {e}")
             return False
     
+    async def a_add_document(self, texts, metadatas, document_id=None, ids=None):
+        """add_document的异步版本，在线程中执行，避免阻塞事件循环"""
+        return await asyncio.to_thread(self.add_document, texts, metadatas, document_id, ids)
+
+    async def a_update_document(self, document_id, texts, metadatas, ids=None):
+        """update_document的异步版本"""
+        return await asyncio.to_thread(self.update_document, document_id, texts, metadatas, ids)
+
+    async def a_delete_document(self, document_id):
+        """delete_document的异步版本"""
+        return await asyncio.to_thread(self.delete_document, document_id)
+
+    async def a_search_documents(self, query, k=10, filter_metadata=None):
+        """search_documents的异步版本"""
+        return await asyncio.to_thread(self.search_documents, query, k, filter_metadata)
+
     def update_document(self, document_id, texts, metadatas, ids=None):
         """更新文档"""
         if not self.collection:
@@ -151,10 +403,19 @@ class VectorManager:
         if not self.collection:
             raise Exception("ChromaDB未初始化")
         
+        # 空集合直接返回，省去一次向量化和查询
+        if self._index_loaded and self._total_chunks == 0:
+            return []
+
         try:
             where_clause = filter_metadata if filter_metadata else None
+            # 查询向量走缓存，聊天中重复的问题不必重新向量化
+            if self.embedding_function:
+                query_args = {"query_embeddings": self._embed([query])}
+            else:
+                query_args = {"query_texts": [query]}
             results = self.collection.query(
-                query_texts=[query], 
+                **query_args,
                 n_results=k,
                 where=where_clause,
                 include=['documents', 'metadatas', 'distances']
@@ -167,14 +428,15 @@ class VectorManager:
                 metadatas = results.get('metadatas', [[]])[0]
                 distances = results.get('distances', [[]])[0]
                 
+                # 转换距离为相似度分数，确保非负：
+                # l2为归一化向量的平方欧氏距离(0~4)，1-d/2即余弦相似度；cosine/ip距离为1-相似度
+                scale = self._distance_scale
                 for i, doc_content in enumerate(docs):
-                    # 创建文档对象
-                    doc_obj = type('Document', (), {
-                        'page_content': doc_content,
-                        'metadata': metadatas[i] if i < len(metadatas) else {},
-                        'score': max(0.0, 1.0 - distances[i]) if i < len(distances) else 0.0  # 转换距离为相似度分数，确保非负
-                    })()
-                    documents.append(doc_obj)
+                    documents.append(SearchResult(
+                        doc_content,
+                        metadatas[i] if i < len(metadatas) else {},
+                        max(0.0, 1.0 - distances[i] * scale) if i < len(distances) else 0.0
+                    ))
             
             return documents
         except Exception as e:
@@ -185,25 +447,24 @@ class VectorManager:
         """列出文档"""
         if not self.collection:
             return []
-        
+
+        if self._index_loaded:
+            with self._index_lock:
+                docs = self._doc_metadata.values()
+                return list(itertools.islice(docs, limit)) if limit else list(docs)
+
         try:
-            results = self.collection.get(include=['metadatas'])
-            if not results or not results.get('metadatas'):
-                return []
-            
-            # 按document_id分组，避免重复
+            # 分页读取并按document_id分组，避免重复；达到limit后提前结束，不再读取后续页
             documents = {}
-            for i, metadata in enumerate(results['metadatas']):
+            for _, metadata in self._iter_chunk_metadatas():
                 if metadata and 'document_id' in metadata:
                     doc_id = metadata['document_id']
                     if doc_id not in documents:
                         documents[doc_id] = metadata
-            
-            doc_list = list(documents.values())
-            if limit:
-                doc_list = doc_list[:limit]
-                
-            return doc_list
+                        if limit and len(documents) >= limit:
+                            break
+
+            return list(documents.values())
         except Exception as e:
             logger.error(f"列出文档时出错: {e}")
             return []
@@ -212,6 +473,13 @@ class VectorManager:
         """获取集合统计信息"""
         if not self.collection:
             return {"total_documents": 0}
+
+        if self._index_loaded:
+            return {
+                "total_documents": self._total_chunks,
+                "unique_documents": len(self._doc_metadata)
+            }
+
         try:
             count = self.collection.count()
             return {"total_documents": count}
@@ -219,64 +487,102 @@ class VectorManager:
             logger.error(f"获取统计信息时出错: {e}")
             return {"total_documents": 0}
 
+_vector_manager = None
+_vector_manager_lock = threading.Lock()
+
 def get_vector_manager():
-    """获取向量管理器"""
-    collection = init_chroma()
-    return VectorManager(collection)
+    """获取向量管理器（进程内单例，内存索引只构建一次）"""
+    global _vector_manager
+    if _vector_manager is None:
+        with _vector_manager_lock:
+            if _vector_manager is None:
+                collection = init_chroma()
+                _vector_manager = VectorManager(collection, chroma_embedding_function)
+    return _vector_manager
+
+def compute_file_sha256(file: UploadFile) -> str:
+    """计算上传文件内容的SHA-256指纹，计算后重置读取位置"""
+    file.file.seek(0)
+    digest = hashlib.file_digest(file.file, "sha256").hexdigest()
+    file.file.seek(0)
+    return digest
+
+# 支持的扩展名集合（O(1)查找）
+_SUPPORTED_EXTS = frozenset(SUPPORTED_FORMATS)
 
-def validate_file(file: UploadFile) -> Tuple[bool, str]:
+# 允许的MIME类型及其对应扩展名
+_MIME_TO_EXTS = {
+    'application/pdf': ('.pdf',),
+    'text/plain': ('.txt', '.md', '.log'),
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document': ('.docx',),
+    'application/msword': ('.doc',)
+}
+_EXT_TO_MIME = {ext: mime for mime, exts in _MIME_TO_EXTS.items() for ext in exts}
+
+# MIME与扩展名不匹配时也不告警的类型
+_LENIENT_MIMES = frozenset({'text/x-python', 'application/javascript', 'application/json'})
+
+def _probe(file: UploadFile) -> dict:
+    """
+    探测上传文件的扩展名、大小和MIME类型
+    结果缓存在UploadFile对象上，同一请求内重复调用不再seek文件
+    """
+    meta = getattr(file, '_hrkb_meta', None)
+    if meta is None:
+        filename = file.filename or ''
+        file_size = getattr(file, 'size', None)
+        if file_size is None:
+            file.file.seek(0, 2)  # 移动到文件末尾
+            file_size = file.file.tell()
+            file.file.seek(0)  # 重置到文件开头
+        meta = {
+            "ext": filename.split('.')[-1].lower() if '.' in filename else '',
+            "size": file_size,
+            "mime": mimetypes.guess_type(filename)[0] if filename else None
+        }
+        file._hrkb_meta = meta
+    return meta
+
+def validate_file(file: UploadFile) -> Tuple[bool, str, int]:
     """
     验证上传文件的有效性
-    返回: (是否有效, 错误信息)
+    返回: (是否有效, 错误信息, 文件大小)
     """
     try:
         # 检查文件名
         if not file.filename:
-            return False, "文件名不能为空"
+            return False, "文件名不能为空", 0
         
+        meta = _probe(file)
+
         # 检查文件扩展名
-        file_ext = file.filename.split('.')[-1].lower() if '.' in file.filename else ''
+        file_ext = meta["ext"]
         if not file_ext:
-            return False, "文件必须有扩展名"
+            return False, "文件必须有扩展名", 0
         
-        if f".{file_ext}" not in SUPPORTED_FORMATS:
-            return False, f"不支持的文件格式: .{file_ext}。支持的格式: {', '.join(SUPPORTED_FORMATS)}"
+        if f".{file_ext}" not in _SUPPORTED_EXTS:
+            return False, f"不支持的文件格式: .{file_ext}。支持的格式: {', '.join(SUPPORTED_FORMATS)}", 0
         
         # 检查文件大小
-        file.file.seek(0, 2)  # 移动到文件末尾
-        file_size = file.file.tell()
-        file.file.seek(0)  # 重置到文件开头
-        
+        file_size = meta["size"]
         if file_size == 0:
-            return False, "文件不能为空"
+            return False, "文件不能为空", 0
         
         if file_size > MAX_FILE_SIZE:
-            return False, f"文件大小超过限制 ({file_size / (1024*1024):.1f}MB > {MAX_FILE_SIZE / (1024*1024)}MB)"
+            return False, f"文件大小超过限制 ({file_size / (1024*1024):.1f}MB > {MAX_FILE_SIZE / (1024*1024)}MB)", 0
         
         # 检查MIME类型（如果可能）
-        mime_type, _ = mimetypes.guess_type(file.filename)
+        mime_type = meta["mime"]
         if mime_type:
-            allowed_mimes = {
-                'application/pdf': ['.pdf'],
-                'text/plain': ['.txt', '.md', '.log'],
-                'application/vnd.openxmlformats-officedocument.wordprocessingml.document': ['.docx'],
-                'application/msword': ['.doc']
-            }
-            
-            valid_mime = False
-            for allowed_mime, extensions in allowed_mimes.items():
-                if mime_type == allowed_mime and f".{file_ext}" in extensions:
-                    valid_mime = True
-                    break
-            
-            if not valid_mime and mime_type not in ['text/x-python', 'application/javascript', 'application/json']:
+            valid_mime = _EXT_TO_MIME.get(f".{file_ext}") == mime_type
+            if not valid_mime and mime_type not in _LENIENT_MIMES:
                 logger.warning(f"MIME类型可能不匹配: {mime_type} for {file.filename}")
         
-        return True, ""
+        return True, "", file_size
         
     except Exception as e:
         logger.error(f"文件验证失败: {str(e)}")
-        return False, f"文件验证失败: {str(e)}"
+        return False, f"文件验证失败: {str(e)}", 0
 
 def get_optimal_chunk_settings(file_ext: str, file_size: int) -> Tuple[int, int]:
     """
@@ -315,32 +621,158 @@ def get_optimal_chunk_settings(file_ext: str, file_size: int) -> Tuple[int, int]
     
     return chunk_size, overlap
 
+# 纯文本类文件扩展名，统一使用TextLoader加载
+_TEXT_EXTS = frozenset({
+    "txt", "md", "c", "h", "cpp", "hpp", "java", "js", "ts", "jsx", "tsx",
+    "vue", "py", "go", "rs", "sql", "json", "yml", "yaml", "cfg", "ini", "log"
+})
+
+# PDFium库没有内部锁，跨线程并发调用会破坏内存
+_pdfium_lock = threading.Lock()
+
+class PdfiumLoader:
+    """基于pypdfium2(PDFium C库)的PDF加载器，输出与PyPDFLoader一致（每页一个Document）"""
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+
+    def load(self) -> List[Document]:
+        documents = []
+        # PDFium不是线程安全的，上传在工作线程中处理，所有PDFium调用必须串行
+        with _pdfium_lock:
+            pdf = pdfium.PdfDocument(self.file_path)
+            try:
+                for page_number, page in enumerate(pdf):
+                    try:
+                        textpage = page.get_textpage()
+                        try:
+                            text = textpage.get_text_bounded()
+                        finally:
+                            textpage.close()
+                    finally:
+                        page.close()
+                    documents.append(Document(
+                        # PDFium以\r\n换行，统一为\n，与PyPDFLoader一致，分割器的段落分隔符才能生效
+                        page_content=text.replace("\r\n", "\n"),
+                        metadata={"source": self.file_path, "page": page_number}
+                    ))
+            finally:
+                pdf.close()
+        return documents
+
+# 其他格式的加载器分派表
+_LOADER_MAP = {
+    'pdf': PdfiumLoader if pdfium is not None else PyPDFLoader,
+    'docx': Docx2txtLoader,
+    'doc': Docx2txtLoader,
+}
+
+# 编码检测只采样文件开头部分
+ENCODING_SAMPLE_SIZE = 64 * 1024
+
+def _best_encoding(matches) -> str:
+    """从charset_normalizer的检测结果中取编码，无法判断时按utf-8处理"""
+    best_match = matches.best()
+    if best_match is None or best_match.encoding == 'ascii':
+        # 纯ASCII按utf-8读取，采样范围之后出现的中文也能正确解码
+        return 'utf-8'
+    return best_match.encoding
+
+def _detect_text_encoding(temp_path: str) -> str:
+    """根据文件开头64KB检测文本编码，采样无法可靠判断时退回整文件检测"""
+    with open(temp_path, 'rb') as f:
+        head = f.read(ENCODING_SAMPLE_SIZE)
+        truncated = bool(f.read(1))
+
+    if not truncated:
+        return _best_encoding(charset_from_bytes(head))
+
+    # 采样可能截断在多字节字符中间，导致误判，先退回到最后一个换行处
+    cut = head.rfind(b'\n')
+    if cut > 0:
+        head = head[:cut + 1]
+    encoding = _best_encoding(charset_from_bytes(head))
+
+    # 用检测出的编码解码采样加以验证，失败则对整个文件重新检测
+    try:
+        head.decode(encoding)
+    except (UnicodeDecodeError, LookupError):
+        logger.warning(f"采样编码检测结果 {encoding} 无法解码，改为整文件检测: {temp_path}")
+        encoding = _best_encoding(charset_from_path(temp_path))
+    return encoding
+
 def create_document_loader(temp_path: str, file_ext: str, filename: str):
     """
     根据文件类型创建合适的文档加载器
     """
     try:
-        if file_ext == 'pdf':
-            # 优先使用PyPDFLoader
-            return PyPDFLoader(temp_path)
-        elif file_ext in ["txt", "md", "c", "h", "cpp", "hpp", "java", "js", "ts", "jsx", "tsx",
-                          "vue", "py", "go", "rs", "sql", "json", "yml", "yaml", "cfg", "ini", "log"]:
-            # 尝试多种编码
-            encodings = ['utf-8', 'gbk', 'gb2312', 'utf-16', 'latin1']
-            for encoding in encodings:
-                try:
-                    return TextLoader(temp_path, encoding=encoding)
-                except UnicodeDecodeError:
-                    continue
-            raise ValueError(f"无法使用任何编码读取文件: {filename}")
-        elif file_ext in ['docx', 'doc']:
-            return Docx2txtLoader(temp_path)
-        else:
+        if file_ext in _TEXT_EXTS:
+            # 预先检测一次编码（TextLoader在load时才读文件，逐个试编码无法生效）
+            return TextLoader(temp_path, encoding=_detect_text_encoding(temp_path), autodetect_encoding=False)
+
+        loader_cls = _LOADER_MAP.get(file_ext)
+        if loader_cls is None:
             raise ValueError(f'不支持的文档格式: {file_ext}')
+        return loader_cls(temp_path)
     except Exception as e:
         logger.error(f"创建文档加载器失败: {str(e)}")
         raise
 
+@lru_cache(maxsize=32)
+def _get_text_splitter(chunk_size: int, chunk_overlap: int) -> RecursiveCharacterTextSplitter:
+    """按分块设置缓存文本分割器（分割器无可变状态，可跨请求复用）"""
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=len,
+        separators=["\n\n", "\n", "。", "！", "？", "；", " ", ""]
+    )
+
+def _split_valid_chunks(text_splitter, documents) -> List[str]:
+    """
+    逐页分割文本并在同一遍中去除首尾空白、过滤过短的块（每块只strip一次）
+    不再构造中间的Document列表
+    """
+    return [
+        chunk
+        for doc in documents
+        for piece in text_splitter.split_text(doc.page_content)
+        if len(chunk := piece.strip()) >= 20  # 至少20个字符
+    ]
+
+def _copy_upload_to(file: UploadFile, temp_file, file_size: int):
+    """
+    将上传内容写入临时文件
+    已落盘的上传在支持sendfile的系统上走内核拷贝，否则以1MB为块用copyfileobj
+    """
+    # 按已知大小预先分配磁盘空间，减少写入过程中文件系统的extent分配
+    if file_size and hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(temp_file.fileno(), 0, file_size)
+        except OSError as e:
+            logger.debug("预分配临时文件空间失败: %s", e)
+
+    # 仅对已滚动到磁盘的SpooledTemporaryFile使用sendfile，内存中的上传调用fileno()会强制落盘
+    if hasattr(os, 'sendfile') and getattr(file.file, '_rolled', False):
+        try:
+            src_fd, dst_fd = file.file.fileno(), temp_file.fileno()
+            offset = 0
+            while offset < file_size:
+                sent = os.sendfile(dst_fd, src_fd, offset, file_size - offset)
+                if sent == 0:
+                    break
+                offset += sent
+            if offset == file_size:
+                return
+        except OSError as e:
+            logger.debug("sendfile拷贝失败，回退为copyfileobj: %s", e)
+        temp_file.seek(0)
+        file.file.seek(0)
+
+    shutil.copyfileobj(file.file, temp_file, length=UPLOAD_COPY_BUFFER_SIZE)
+    # 截断到实际写入位置，避免预分配的多余部分留在文件末尾
+    temp_file.truncate()
+
 def process_upload_file(file: UploadFile) -> List[str]:
     """
     处理上传的文件并提取文本内容
@@ -349,16 +781,13 @@ def process_upload_file(file: UploadFile) -> List[str]:
     logger.info(f"开始处理文件: {file.filename}")
     
     # 1. 文件验证
-    is_valid, error_msg = validate_file(file)
+    is_valid, error_msg, file_size = validate_file(file)
     if not is_valid:
         logger.error(f"文件验证失败: {error_msg}")
         raise ValueError(error_msg)
     
-    # 2. 获取文件信息
-    file_ext = file.filename.split('.')[-1].lower()
-    file.file.seek(0, 2)
-    file_size = file.file.tell()
-    file.file.seek(0)
+    # 2. 获取文件信息（大小已在验证时取得）
+    file_ext = _probe(file)["ext"]
     
     logger.info(f"文件信息: 类型={file_ext}, 大小={file_size / 1024:.1f}KB")
     
@@ -366,13 +795,7 @@ def process_upload_file(file: UploadFile) -> List[str]:
     temp_path = None
     try:
         with tempfile.NamedTemporaryFile(delete=False, suffix=f".{file_ext}") as temp_file:
-            # 分块读取文件内容，避免内存问题
-            chunk_size = 8192
-            while True:
-                chunk = file.file.read(chunk_size)
-                if not chunk:
-                    break
-                temp_file.write(chunk)
+            _copy_upload_to(file, temp_file, file_size)
             temp_path = temp_file.name
         
         logger.info(f"临时文件创建成功: {temp_path}")
@@ -384,13 +807,8 @@ def process_upload_file(file: UploadFile) -> List[str]:
         # 5. 创建文档加载器
         loader = create_document_loader(temp_path, file_ext, file.filename)
         
-        # 6. 创建文本分割器
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-            length_function=len,
-            separators=["\n\n", "\n", "。", "！", "？", "；", " ", ""]
-        )
+        # 6. 获取文本分割器
+        text_splitter = _get_text_splitter(chunk_size, chunk_overlap)
         
         # 7. 加载和分割文档
         try:
@@ -405,15 +823,8 @@ def process_upload_file(file: UploadFile) -> List[str]:
             if total_content < 10:
                 raise ValueError("文档内容过少，可能是空文档或格式不正确")
             
-            documents = text_splitter.split_documents(documents)
-            logger.info(f"文档分割完成，分块数: {len(documents)}")
-            
-            # 过滤空白或过短的块
-            valid_chunks = []
-            for doc in documents:
-                content = doc.page_content.strip()
-                if len(content) >= 20:  # 至少20个字符
-                    valid_chunks.append(content)
+            # 分割并过滤空白或过短的块
+            valid_chunks = _split_valid_chunks(text_splitter, documents)
             
             if not valid_chunks:
                 raise ValueError("文档分割后没有有效内容块")
@@ -428,13 +839,11 @@ def process_upload_file(file: UploadFile) -> List[str]:
             if file_ext == 'pdf':
                 try:
                     logger.warning("尝试使用备用PDF处理方法")
-                    loader = UnstructuredPDFLoader(temp_path)
+                    loader = _get_unstructured_pdf_loader()(temp_path)
                     documents = loader.load()
                     
                     if documents:
-                        documents = text_splitter.split_documents(documents)
-                        valid_chunks = [doc.page_content.strip() for doc in documents 
-                                      if len(doc.page_content.strip()) >= 20]
+                        valid_chunks = _split_valid_chunks(text_splitter, documents)
                         if valid_chunks:
                             logger.info(f"备用方法成功，有效块数: {len(valid_chunks)}")
                             return valid_chunks
@@ -453,12 +862,14 @@ def process_upload_file(file: UploadFile) -> List[str]:
         raise ValueError(f'文件处理失败: {str(e)}')
     
     finally:
-        # 9. 清理临时文件
-        if temp_path and os.path.exists(temp_path):
+        # 9. 清理临时文件（直接unlink，不存在时忽略，避免先exists再删除的竞态）
+        if temp_path:
             try:
                 os.unlink(temp_path)
                 logger.info("临时文件清理完成")
-            except Exception as e:
+            except FileNotFoundError:
+                pass
+            except OSError as e:
                 logger.warning(f"临时文件清理失败: {str(e)}")
 
 def get_document_info(file: UploadFile) -> dict:
@@ -466,21 +877,16 @@ def get_document_info(file: UploadFile) -> dict:
     获取文档基本信息，不进行实际处理
     """
     try:
-        file_ext = file.filename.split('.')[-1].lower() if '.' in file.filename else ''
-        
-        file.file.seek(0, 2)
-        file_size = file.file.tell()
-        file.file.seek(0)
-        
-        mime_type, _ = mimetypes.guess_type(file.filename)
-        
+        meta = _probe(file)
+        file_ext, file_size, mime_type = meta["ext"], meta["size"], meta["mime"]
+
         return {
             "filename": file.filename,
             "extension": file_ext,
             "size_bytes": file_size,
             "size_mb": round(file_size / (1024 * 1024), 2),
             "mime_type": mime_type,
-            "is_supported": f".{file_ext}" in SUPPORTED_FORMATS,
+            "is_supported": f".{file_ext}" in _SUPPORTED_EXTS,
             "estimated_chunks": max(1, file_size // 1000)  # 粗略估计
         }
     except Exception as e:
@@ -1,10 +1,29 @@
 import json
 import os
+import threading
 from typing import List, Dict, Optional
 from langchain_ollama import ChatOllama
 from logging_setup import logger
 from config import OLLAMA_MODEL, OLLAMA_BASE_URL
 
+# 改进的意图分析 - 按优先级和权重排序
+INTENT_KEYWORDS = {
+    'attendance': ['考勤', '打卡', '请假', '休假', '迟到', '早退', '出勤'],
+    'salary': ['薪资', '工资', '薪酬', '奖金', '发放', '薪水'],
+    'onboarding': ['入职', '新员工', '报到', '入职手续'],
+    'offboarding': ['离职', '辞职', '退休', '离职手续', '离职流程'],
+    'training': ['培训', '学习', '发展', '课程', '培训计划'],
+    'benefit': ['福利', '待遇', '补贴', '津贴', '福利待遇'],
+    'process': ['流程', '步骤', '程序', '办理', '怎么办', '如何'],
+    'policy': ['政策', '制度', '规定', '条例', '政策制度']
+}
+
+# 预先计算关键词权重：更具体的关键词（超过2个字）权重更高
+_INTENT_KEYWORD_WEIGHTS = tuple(
+    (intent, tuple((keyword, 2 if len(keyword) > 2 else 1) for keyword in keywords))
+    for intent, keywords in INTENT_KEYWORDS.items()
+)
+
 class HRKnowledgeAgent:
     """人事知识库智能代理 - 优化版本"""
     
@@ -27,7 +46,6 @@ class HRKnowledgeAgent:
         """初始化LLM - 针对qwen3:8b优化"""
         try:
             # qwen3:8b模型优化配置
-            from langchain_ollama import ChatOllama
             self.llm = ChatOllama(
                 model=OLLAMA_MODEL,
                 base_url=OLLAMA_BASE_URL,
@@ -73,14 +91,6 @@ class HRKnowledgeAgent:
         user_role = user_ctx.get('user_role', 'hr_staff')
         department = user_ctx.get('department', 'HR')
         
-        # 根据用户角色调整回答风格
-        role_context = {
-            'hr_staff': '作为人事专员，请提供详细的操作指导',
-            'hr_manager': '作为人事经理，请提供管理层面的建议',
-            'hr_director': '作为人事总监，请提供战略层面的分析',
-            'employee': '作为员工，请提供易懂的政策解释'
-        }.get(user_role, '请提供专业的人事指导')
-        
         # 简化的提示词，避免过长导致截断
         prompt = f"""你是一个专业的人事知识库助手。请基于提供的文档内容回答用户问题。
 
@@ -182,30 +192,11 @@ class HRKnowledgeAgent:
     def analyze_query_intent(self, question: str) -> Dict:
         """分析查询意图"""
         try:
-            # 改进的意图分析 - 按优先级和权重排序
-            intent_keywords = {
-                'attendance': ['考勤', '打卡', '请假', '休假', '迟到', '早退', '出勤'],
-                'salary': ['薪资', '工资', '薪酬', '奖金', '发放', '薪水'],
-                'onboarding': ['入职', '新员工', '报到', '入职手续'],
-                'offboarding': ['离职', '辞职', '退休', '离职手续', '离职流程'],
-                'training': ['培训', '学习', '发展', '课程', '培训计划'],
-                'benefit': ['福利', '待遇', '补贴', '津贴', '福利待遇'],
-                'process': ['流程', '步骤', '程序', '办理', '怎么办', '如何'],
-                'policy': ['政策', '制度', '规定', '条例', '政策制度']
-            }
-            
             detected_intents = []
             intent_scores = {}
             
-            for intent, keywords in intent_keywords.items():
-                score = 0
-                for keyword in keywords:
-                    if keyword in question:
-                        # 给更具体的关键词更高的权重
-                        if len(keyword) > 2:
-                            score += 2
-                        else:
-                            score += 1
+            for intent, weighted_keywords in _INTENT_KEYWORD_WEIGHTS:
+                score = sum(weight for keyword, weight in weighted_keywords if keyword in question)
                 
                 if score > 0:
                     detected_intents.append(intent)
@@ -220,7 +211,7 @@ class HRKnowledgeAgent:
             return {
                 'intents': detected_intents,
                 'primary_intent': primary_intent,
-                'confidence': len(detected_intents) / len(intent_keywords)
+                'confidence': len(detected_intents) / len(INTENT_KEYWORDS)
             }
         
         except Exception as e:
@@ -229,12 +220,15 @@ class HRKnowledgeAgent:
 
 # 全局代理实例
 hr_agent = None
+_hr_agent_lock = threading.Lock()
 
 def get_hr_agent() -> HRKnowledgeAgent:
-    """获取人事知识库代理实例"""
+    """获取人事知识库代理实例（双重检查加锁，避免并发请求重复创建）"""
     global hr_agent
     if hr_agent is None:
-        hr_agent = HRKnowledgeAgent()
+        with _hr_agent_lock:
+            if hr_agent is None:
+                hr_agent = HRKnowledgeAgent()
     return hr_agent
 
 def integrate_results(vector_results: List, sql_results: List, question: str, user_ctx: Dict) -> str:
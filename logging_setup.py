@@ -1,9 +1,12 @@
 import logging
 from config import LOG_FILE_NAME
 
+# delay=True：首次写日志时才打开文件，导入模块时不做文件 I/O
+_file_handler = logging.FileHandler(LOG_FILE_NAME, encoding='utf-8', delay=True)
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(filename)s[line:%(lineno)d] - %(levelname)s: %(message)s',
-    filename=LOG_FILE_NAME
+    handlers=[_file_handler]
 )
 logger = logging.getLogger("factory_kb")
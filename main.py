@@ -1,4 +1,5 @@
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
@@ -15,7 +16,8 @@ import services
 app = FastAPI(
     title=APP_TITLE,
     description=APP_DESCRIPTION,
-    version=APP_VERSION
+    version=APP_VERSION,
+    default_response_class=ORJSONResponse  # orjson 序列化 JSON 响应，比标准库 json 更快
 )
 
 # 添加CORS中间件，支持前端访问
@@ -4,6 +4,10 @@ import psutil
 import os
 from services import service_health_check, service_vector_status, service_get_collection_stats
 from schemas import HealthResponse, VectorStoreStatus
+from config import (
+    APP_TITLE, APP_VERSION, CHROMA_DB_PATH, OLLAMA_MODEL,
+    MAX_FILE_SIZE, SUPPORTED_FORMATS, QUERY_TIMEOUT, LOG_FILE_NAME
+)
 
 router = APIRouter()
 
@@ -94,11 +98,6 @@ async def system_information() -> dict:
     返回系统配置信息和运行环境
     """
     try:
-        from config import (
-            APP_TITLE, APP_VERSION, CHROMA_DB_PATH, OLLAMA_MODEL,
-            MAX_FILE_SIZE, SUPPORTED_FORMATS, QUERY_TIMEOUT
-        )
-        
         return {
             "status": "success",
             "system_config": {
@@ -144,8 +143,6 @@ async def get_recent_logs(lines: int = 50) -> dict:
     - **lines**: 返回的日志行数（默认50行，最多200行）
     """
     try:
-        from config import LOG_FILE_NAME
-        
         lines = min(lines, 200)  # 限制最大行数
         
         if os.path.exists(LOG_FILE_NAME):
@@ -1,7 +1,7 @@
 """
 聊天会话管理 API
 """
-from fastapi import APIRouter, Depends, HTTPException, Body
+from fastapi import APIRouter, Depends, HTTPException, Body, Query
 from fastapi.responses import Response
 from sqlalchemy.orm import Session
 from database import get_db
@@ -10,6 +10,8 @@ from chat_service import (
     get_chat_sessions,
     get_chat_session,
     add_chat_message,
+    add_chat_messages_bulk,
+    get_chat_messages,
     delete_chat_session,
     update_chat_session_title,
     get_first_user_message
@@ -18,6 +20,8 @@ from title_generator import generate_session_title
 from pydantic import BaseModel
 from typing import List, Optional
 from datetime import datetime
+from urllib.parse import quote
+from logging_setup import logger
 
 router = APIRouter()
 
@@ -33,6 +37,10 @@ class AddMessageRequest(BaseModel):
     content: str
 
 
+class AddMessagesBatchRequest(BaseModel):
+    messages: List[AddMessageRequest]
+
+
 class UpdateTitleRequest(BaseModel):
     title: str
 
@@ -73,12 +81,13 @@ async def create_session(
 @router.get("/chat-sessions", response_model=dict)
 async def list_sessions(
     user_id: Optional[str] = None,
-    limit: int = 50,
+    limit: int = Query(50, ge=1, le=200),
+    offset: int = Query(0, ge=0),
     db: Session = Depends(get_db)
 ):
-    """获取聊天会话列表"""
+    """获取聊天会话列表（含最后一条消息预览）"""
     try:
-        sessions = get_chat_sessions(db, user_id, limit)
+        sessions = get_chat_sessions(db, user_id, limit, offset)
         return {
             "status": "success",
             "sessions": sessions,
@@ -126,6 +135,47 @@ async def add_message(
         raise HTTPException(status_code=500, detail=f"添加消息失败: {str(e)}")
 
 
+@router.post("/chat-sessions/{session_id}/messages/batch", response_model=dict)
+async def add_messages_batch(
+    session_id: str,
+    request: AddMessagesBatchRequest,
+    db: Session = Depends(get_db)
+):
+    """批量添加聊天消息（导入历史记录）"""
+    try:
+        count = add_chat_messages_bulk(
+            db,
+            session_id,
+            [{"role": msg.role, "content": msg.content} for msg in request.messages]
+        )
+        return {
+            "status": "success",
+            "count": count
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"批量添加消息失败: {str(e)}")
+
+
+@router.get("/chat-sessions/{session_id}/messages", response_model=dict)
+async def list_messages(
+    session_id: str,
+    after_sequence: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=200),
+    db: Session = Depends(get_db)
+):
+    """分页获取聊天消息（传入上一页最后一条消息的 sequence 继续加载）"""
+    try:
+        messages = get_chat_messages(db, session_id, after_sequence, limit)
+        return {
+            "status": "success",
+            "messages": messages,
+            "count": len(messages),
+            "next_sequence": messages[-1]["sequence"] if messages and len(messages) == limit else None
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取消息失败: {str(e)}")
+
+
 @router.put("/chat-sessions/{session_id}/title", response_model=dict)
 async def update_title(
     session_id: str,
@@ -210,9 +260,6 @@ async def export_session(
     db: Session = Depends(get_db)
 ):
     """导出聊天会话为 Markdown 格式"""
-    from logging_setup import logger
-    from urllib.parse import quote
-    
     try:
         logger.info(f"开始导出会话: {session_id}")
         
@@ -225,18 +272,20 @@ async def export_session(
         logger.info(f"会话信息获取成功: {session['title']}, 消息数量: {len(session['messages'])}")
         
         # 生成 Markdown 内容
-        markdown_content = f"""# {session['title']}
+        markdown_parts = [f"""# {session['title']}
 
 **导出时间**: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
 
 ---
 
-"""
+"""]
         
         # 添加消息内容
         for msg in session['messages']:
             role_name = "用户" if msg['role'] == 'user' else "AI 助手"
-            markdown_content += f"## {role_name}\n\n{msg['text']}\n\n---\n\n"
+            markdown_parts.append(f"## {role_name}\n\n{msg['text']}\n\n---\n\n")
+        
+        markdown_content = "".join(markdown_parts)
         
         logger.info(f"Markdown 内容生成成功，长度: {len(markdown_content)}")
         
@@ -25,7 +25,7 @@ async def upload_document(
     - **access_level**: 访问权限（public、internal、confidential、restricted）
     - **user_ctx**: 用户上下文信息
     """
-    return service_upload_document(file, title, category, access_level, user_ctx)
+    return await service_upload_document(file, title, category, access_level, user_ctx)
 
 @router.get("/documents", response_model=List[DocumentInfo])
 async def list_documents(
@@ -79,7 +79,7 @@ async def update_document(
     - **access_level**: 新的访问权限
     - **user_ctx**: 用户上下文信息
     """
-    return service_update_document(document_id, file, title, category, access_level, user_ctx)
+    return await service_update_document(document_id, file, title, category, access_level, user_ctx)
 
 @router.delete("/documents/{document_id}")
 async def delete_document(
@@ -90,7 +90,7 @@ async def delete_document(
     
     - **document_id**: 要删除的文档ID
     """
-    return service_delete_document(document_id)
+    return await service_delete_document(document_id)
 
 @router.get("/search-documents")
 async def search_documents(
@@ -107,7 +107,7 @@ async def search_documents(
     - **access_level**: 可选，按访问权限过滤
     - **k**: 返回结果数量（1-20）
     """
-    results = service_search_documents(query, category, access_level, k)
+    results = await service_search_documents(query, category, access_level, k)
     
     return {
         "status": "success",
@@ -1,11 +1,13 @@
+import os
 import time
 import json
+import uuid
 import asyncio
 from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from fastapi import HTTPException
 from logging_setup import logger
-from knowledge_base import init_chroma, process_upload_file
+from knowledge_base import init_chroma, process_upload_file, compute_file_sha256
 from knowledge_base import get_vector_manager
 from schemas import (
     QueryRequest, QueryResponse, DocumentUploadResponse, 
@@ -16,10 +18,51 @@ from llm_agent import integrate_results, analyze_query, get_hr_agent
 from typing import List, Optional, AsyncGenerator, Dict
 from config import QUERY_TIMEOUT, MAX_QUERY_RESULTS
 
+# 常见人事术语标准化映射
+HR_TERM_MAPPING = {
+    '工资': '薪资',
+    '薪水': '薪资',
+    '年假': '年休假',
+    '病假': '病事假',
+    '迟到': '考勤',
+    '早退': '考勤',
+    '新人': '新员工',
+    '离职手续': '离职流程'
+}
+
+# 短查询同义词扩展
+QUERY_EXPANSION_MAP = {
+    '薪资': '薪资 工资 薪酬',
+    '考勤': '考勤 打卡 出勤',
+    '请假': '请假 休假 假期',
+    '培训': '培训 学习 发展'
+}
+
+# 用户角色可访问的文档级别
+ROLE_ACCESS_MAP = {
+    'employee': ('public', 'internal'),
+    'hr_staff': ('public', 'internal', 'confidential'),
+    'hr_manager': ('public', 'internal', 'confidential', 'restricted'),
+    'hr_director': ('public', 'internal', 'confidential', 'restricted', 'secret')
+}
+
+# 基于常见人事查询的建议
+COMMON_QUERY_SUGGESTIONS = {
+    '薪资': ('薪资发放时间', '薪资构成说明', '薪资调整政策'),
+    '请假': ('年休假申请流程', '病假政策', '事假规定'),
+    '考勤': ('考勤制度', '打卡要求', '迟到早退处理'),
+    '培训': ('培训计划', '培训报名', '培训证书'),
+    '入职': ('新员工入职流程', '入职材料清单', '试用期政策'),
+    '离职': ('离职手续办理', '离职证明', '工作交接')
+}
+
+# 元数据中的中文取值 -> 枚举
+_CATEGORY_BY_VALUE = {cat.value: cat for cat in DocumentCategory}
+_ACCESS_LEVEL_BY_VALUE = {level.value: level for level in AccessLevel}
+
 # 初始化向量库（chroma）
 try:
     # 设置环境变量解决protobuf版本冲突和禁用遥测
-    import os
     os.environ['PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION'] = 'python'
     os.environ['ANONYMIZED_TELEMETRY'] = 'False'
     os.environ['CHROMA_TELEMETRY'] = 'False'
@@ -46,16 +89,16 @@ except Exception as e:
 def service_query_knowledge(request: QueryRequest) -> QueryResponse:
     """处理人事知识查询请求 - 简化版本"""
     start_time = time.time()
-    logger.info(f"收到人事知识查询: {request.question}")
+    logger.info("收到人事知识查询: %s", request.question)
 
     try:
         # 查询预处理
         processed_query = _preprocess_query(request.question)
-        logger.info(f"查询预处理完成: {processed_query}")
+        logger.info("查询预处理完成: %s", processed_query)
 
         # 查询意图分析
         query_analysis = analyze_query(processed_query)
-        logger.info(f"查询意图分析: {query_analysis}")
+        logger.info("查询意图分析: %s", query_analysis)
 
         # 向量数据库检索
         vector_results = _execute_vector_search(processed_query, query_analysis, request.user_ctx)
@@ -109,30 +152,12 @@ def _preprocess_query(query: str) -> str:
         processed = query.strip()
         
         # 标准化常见人事术语
-        hr_term_mapping = {
-            '工资': '薪资',
-            '薪水': '薪资',
-            '年假': '年休假',
-            '病假': '病事假',
-            '迟到': '考勤',
-            '早退': '考勤',
-            '新人': '新员工',
-            '离职手续': '离职流程'
-        }
-        
-        for old_term, new_term in hr_term_mapping.items():
+        for old_term, new_term in HR_TERM_MAPPING.items():
             processed = processed.replace(old_term, new_term)
         
         # 添加查询扩展（同义词）
         if len(processed) < 10:  # 短查询需要扩展
-            expansion_map = {
-                '薪资': '薪资 工资 薪酬',
-                '考勤': '考勤 打卡 出勤',
-                '请假': '请假 休假 假期',
-                '培训': '培训 学习 发展'
-            }
-            
-            for key, expansion in expansion_map.items():
+            for key, expansion in QUERY_EXPANSION_MAP.items():
                 if key in processed:
                     processed = expansion
                     break
@@ -175,7 +200,7 @@ def _execute_vector_search(query: str, query_analysis: dict, user_ctx: UserConte
         if results is None:
             results = []
             
-        logger.info(f"向量搜索完成: 找到 {len(results)} 个相关文档片段")
+        logger.info("向量搜索完成: 找到 %d 个相关文档片段", len(results))
         return results
         
     except Exception as e:
@@ -203,15 +228,8 @@ def _build_search_filters(primary_intent: str, user_ctx: UserContext) -> dict:
     #     filter_metadata['category'] = intent_category_map[primary_intent]
     
     # 根据用户角色设置访问级别过滤
-    role_access_map = {
-        'employee': ['public', 'internal'],
-        'hr_staff': ['public', 'internal', 'confidential'],
-        'hr_manager': ['public', 'internal', 'confidential', 'restricted'],
-        'hr_director': ['public', 'internal', 'confidential', 'restricted', 'secret']
-    }
-    
     user_role = user_ctx.user_role
-    if user_role in role_access_map:
+    if user_role in ROLE_ACCESS_MAP:
         # 注意：这里需要向量数据库支持 $in 操作符
         # 如果不支持，可以去掉这个过滤条件
         pass  # 暂时不使用访问级别过滤，避免兼容性问题
@@ -253,16 +271,7 @@ def _generate_query_suggestions(query: str) -> list:
     suggestions = []
     
     # 基于常见人事查询的建议
-    common_queries = {
-        '薪资': ['薪资发放时间', '薪资构成说明', '薪资调整政策'],
-        '请假': ['年休假申请流程', '病假政策', '事假规定'],
-        '考勤': ['考勤制度', '打卡要求', '迟到早退处理'],
-        '培训': ['培训计划', '培训报名', '培训证书'],
-        '入职': ['新员工入职流程', '入职材料清单', '试用期政策'],
-        '离职': ['离职手续办理', '离职证明', '工作交接']
-    }
-    
-    for keyword, related_queries in common_queries.items():
+    for keyword, related_queries in COMMON_QUERY_SUGGESTIONS.items():
         if keyword in query:
             suggestions.extend(related_queries[:2])  # 每个类别最多2个建议
             break
@@ -357,7 +366,37 @@ def _handle_query_error(error: Exception, start_time: float) -> QueryResponse:
         processing_time=time.time() - start_time
     )
 
-def service_upload_document(file, title: str, category: str, access_level: str, user_ctx: str) -> DocumentUploadResponse:
+# 文档写入锁：重复检查到写入向量库之间串行，解析与分块仍可并发
+_document_write_lock = asyncio.Lock()
+
+def _ensure_no_duplicate_document(title: str, file_sha256: str, exclude_doc_id: Optional[str] = None):
+    """标题或文件内容与已有文档（exclude_doc_id除外）重复时抛出400"""
+    if vector_manager.check_duplicate_title(title, exclude_doc_id=exclude_doc_id):
+        raise HTTPException(status_code=400, detail=f"文档标题 '{title}' 已存在，请使用不同的标题")
+
+    existing_doc_id = vector_manager.find_document_by_sha256(file_sha256)
+    if existing_doc_id and existing_doc_id != exclude_doc_id:
+        raise HTTPException(status_code=400, detail=f"相同内容的文件已存在 (文档ID: {existing_doc_id})")
+
+def _build_chunk_metadatas(document_id: str, source_file: str, file_sha256: str, title: str,
+                           category: str, access_level: str, user_context: dict, total_chunks: int) -> List[dict]:
+    """构建各文档块的元数据：公共字段只计算一次，每块仅追加chunk_index"""
+    base_metadata = {
+        "document_id": document_id,
+        "doc_type": "uploaded",
+        "access_level": access_level,
+        "title": title,
+        "category": category,
+        "source_file": source_file,
+        "file_sha256": file_sha256,
+        "department": user_context.get("department", "HR"),
+        "uploader": user_context.get("user_role", "hr_staff"),
+        "upload_time": datetime.now().isoformat(),
+        "total_chunks": total_chunks
+    }
+    return [{**base_metadata, "chunk_index": i} for i in range(total_chunks)]
+
+async def service_upload_document(file, title: str, category: str, access_level: str, user_ctx: str) -> DocumentUploadResponse:
     """处理文档上传请求 - 优化版本"""
     try:
         logger.info(f"收到文档上传: {file.filename} (标题: {title})")
@@ -368,44 +407,37 @@ def service_upload_document(file, title: str, category: str, access_level: str,
 
         user_context = json.loads(user_ctx)
 
-        # 检查标题是否重复
-        if vector_manager.check_duplicate_title(title):
-            raise HTTPException(status_code=400, detail=f"文档标题 '{title}' 已存在，请使用不同的标题")
+        # 标题或内容重复时直接拒绝，省去解析与向量化（写入前会在锁内再次确认）
+        file_sha256 = await asyncio.to_thread(compute_file_sha256, file)
+        _ensure_no_duplicate_document(title, file_sha256)
 
         try:
-            document_chunks = process_upload_file(file)
+            # 写临时文件、解析、分块均为阻塞操作，放到线程中执行，避免阻塞事件循环
+            document_chunks = await asyncio.to_thread(process_upload_file, file)
         except Exception as e:
             logger.error(f"文档处理失败: {str(e)}", exc_info=True)
             raise HTTPException(status_code=400, detail=f"文档处理失败: {str(e)}")
 
-        # 生成文档ID
-        doc_id_base = f"hr_doc_{int(time.time())}"
-        document_id = doc_id_base
+        # 生成文档ID（uuid保证同一秒内完成的多个上传也不会冲突）
+        document_id = f"hr_doc_{uuid.uuid4().hex}"
 
         # 优化的元数据结构，适配人事场景
-        metadatas = [{
-            "document_id": document_id,
-            "doc_type": "uploaded",
-            "access_level": access_level,
-            "title": title,
-            "category": category,
-            "source_file": file.filename,
-            "department": user_context.get("department", "HR"),
-            "uploader": user_context.get("user_role", "hr_staff"),
-            "upload_time": datetime.now().isoformat(),
-            "chunk_index": i,
-            "total_chunks": len(document_chunks)
-        } for i, _ in enumerate(document_chunks)]
-
-        chunk_ids = [f"{doc_id_base}_chunk_{i}" for i in range(len(document_chunks))]
-
-        # 使用优化的向量存储管理器
-        success = vector_manager.add_document(
-            texts=document_chunks,
-            metadatas=metadatas,
-            ids=chunk_ids
+        metadatas = _build_chunk_metadatas(
+            document_id, file.filename, file_sha256, title, category, access_level,
+            user_context, len(document_chunks)
         )
 
+        chunk_ids = [f"{document_id}_chunk_{i}" for i in range(len(document_chunks))]
+
+        # 重复检查与写入之间持锁，避免并发上传同标题/同内容的文件都通过检查
+        async with _document_write_lock:
+            _ensure_no_duplicate_document(title, file_sha256)
+            success = await vector_manager.a_add_document(
+                texts=document_chunks,
+                metadatas=metadatas,
+                ids=chunk_ids
+            )
+
         if not success:
             raise HTTPException(status_code=500, detail="文档添加到向量数据库失败")
 
@@ -425,13 +457,13 @@ def service_upload_document(file, title: str, category: str, access_level: str,
         logger.error(f"文档上传失败: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"文档上传失败: {str(e)}")
 
-def service_delete_document(document_id: str) -> dict:
+async def service_delete_document(document_id: str) -> dict:
     """删除文档"""
     try:
         if vector_manager is None:
             raise HTTPException(status_code=500, detail="向量数据库未初始化")
 
-        success = vector_manager.delete_document(document_id)
+        success = await vector_manager.a_delete_document(document_id)
         
         if success:
             return {
@@ -447,7 +479,7 @@ def service_delete_document(document_id: str) -> dict:
         logger.error(f"删除文档失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"删除文档失败: {str(e)}")
 
-def service_update_document(document_id: str, file, title: str, category: str, access_level: str, user_ctx: str) -> DocumentUploadResponse:
+async def service_update_document(document_id: str, file, title: str, category: str, access_level: str, user_ctx: str) -> DocumentUploadResponse:
     """更新文档"""
     try:
         if vector_manager is None:
@@ -455,39 +487,34 @@ def service_update_document(document_id: str, file, title: str, category: str, a
 
         user_context = json.loads(user_ctx)
 
-        # 检查标题是否与其他文档重复（排除当前文档）
-        if vector_manager.check_duplicate_title(title, exclude_doc_id=document_id):
-            raise HTTPException(status_code=400, detail=f"文档标题 '{title}' 已存在，请使用不同的标题")
+        # 标题或内容与其他文档重复时拒绝（排除当前文档，允许重新上传其原文件）
+        file_sha256 = await asyncio.to_thread(compute_file_sha256, file)
+        _ensure_no_duplicate_document(title, file_sha256, exclude_doc_id=document_id)
 
         try:
-            document_chunks = process_upload_file(file)
+            # 写临时文件、解析、分块均为阻塞操作，放到线程中执行，避免阻塞事件循环
+            document_chunks = await asyncio.to_thread(process_upload_file, file)
         except Exception as e:
             logger.error(f"文档处理失败: {str(e)}", exc_info=True)
             raise HTTPException(status_code=400, detail=f"文档处理失败: {str(e)}")
 
         # 使用原有的文档ID
-        metadatas = [{
-            "document_id": document_id,
-            "doc_type": "uploaded",
-            "access_level": access_level,
-            "title": title,
-            "category": category,
-            "source_file": file.filename,
-            "department": user_context.get("department", "HR"),
-            "uploader": user_context.get("user_role", "hr_staff"),
-            "upload_time": datetime.now().isoformat(),
-            "chunk_index": i,
-            "total_chunks": len(document_chunks)
-        } for i, _ in enumerate(document_chunks)]
+        metadatas = _build_chunk_metadatas(
+            document_id, file.filename, file_sha256, title, category, access_level,
+            user_context, len(document_chunks)
+        )
 
         chunk_ids = [f"{document_id}_chunk_{i}" for i in range(len(document_chunks))]
 
-        success = vector_manager.update_document(
-            document_id=document_id,
-            texts=document_chunks,
-            metadatas=metadatas,
-            ids=chunk_ids
-        )
+        # 重复检查与写入之间持锁，避免与并发上传/更新竞争
+        async with _document_write_lock:
+            _ensure_no_duplicate_document(title, file_sha256, exclude_doc_id=document_id)
+            success = await vector_manager.a_update_document(
+                document_id=document_id,
+                texts=document_chunks,
+                metadatas=metadatas,
+                ids=chunk_ids
+            )
 
         if not success:
             raise HTTPException(status_code=500, detail="文档更新失败")
@@ -523,17 +550,8 @@ def service_list_documents(limit: Optional[int] = None) -> List[DocumentInfo]:
             access_level_str = doc.get('access_level', '全员')
             
             # 查找匹配的枚举值
-            category = DocumentCategory.OTHER
-            for cat in DocumentCategory:
-                if cat.value == category_str:
-                    category = cat
-                    break
-            
-            access_level = AccessLevel.PUBLIC
-            for level in AccessLevel:
-                if level.value == access_level_str:
-                    access_level = level
-                    break
+            category = _CATEGORY_BY_VALUE.get(category_str, DocumentCategory.OTHER)
+            access_level = _ACCESS_LEVEL_BY_VALUE.get(access_level_str, AccessLevel.PUBLIC)
             
             doc_info = DocumentInfo(
                 id=doc.get('document_id', ''),
@@ -555,7 +573,7 @@ def service_list_documents(limit: Optional[int] = None) -> List[DocumentInfo]:
         logger.error(f"获取文档列表失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"获取文档列表失败: {str(e)}")
 
-def service_search_documents(query: str, category: Optional[str] = None, access_level: Optional[str] = None, k: int = 5) -> List[dict]:
+async def service_search_documents(query: str, category: Optional[str] = None, access_level: Optional[str] = None, k: int = 5) -> List[dict]:
     """搜索文档"""
     try:
         if vector_manager is None:
@@ -568,7 +586,7 @@ def service_search_documents(query: str, category: Optional[str] = None, access_
         if access_level:
             filter_metadata['access_level'] = access_level
 
-        results = vector_manager.search_documents(
+        results = await vector_manager.a_search_documents(
             query=query,
             k=k,
             filter_metadata=filter_metadata if filter_metadata else None
@@ -666,7 +684,7 @@ def service_get_collection_stats() -> dict:
 async def service_query_knowledge_stream(request: QueryRequest) -> AsyncGenerator[dict, None]:
     """处理人事知识查询请求 - 流式版本"""
     start_time = time.time()
-    logger.info(f"收到流式查询: {request.question}")
+    logger.info("收到流式查询: %s", request.question)
 
     try:
         # 1. 发送查询预处理状态
@@ -679,7 +697,7 @@ async def service_query_knowledge_stream(request: QueryRequest) -> AsyncGenerato
         
         # 查询预处理
         processed_query = _preprocess_query(request.question)
-        logger.info(f"查询预处理完成: {processed_query}")
+        logger.info("查询预处理完成: %s", processed_query)
         
         # 2. 发送意图分析状态
         yield {
@@ -691,7 +709,7 @@ async def service_query_knowledge_stream(request: QueryRequest) -> AsyncGenerato
 
         # 查询意图分析
         query_analysis = analyze_query(processed_query)
-        logger.info(f"查询意图分析: {query_analysis}")
+        logger.info("查询意图分析: %s", query_analysis)
 
         # 3. 发送向量检索状态
         yield {
@@ -701,8 +719,10 @@ async def service_query_knowledge_stream(request: QueryRequest) -> AsyncGenerato
             'progress': 30
         }
 
-        # 向量数据库检索
-        vector_results = _execute_vector_search(processed_query, query_analysis, request.user_ctx)
+        # 向量数据库检索（在线程中执行，检索期间不阻塞其他流式响应）
+        vector_results = await asyncio.to_thread(
+            _execute_vector_search, processed_query, query_analysis, request.user_ctx
+        )
         
         if not vector_results:
             yield {
@@ -736,19 +756,22 @@ async def service_query_knowledge_stream(request: QueryRequest) -> AsyncGenerato
         logger.info("开始流式LLM回答生成...")
         
         # 使用流式生成
-        full_answer = ""
+        answer_parts = []
+        answer_length = 0
         chunk_count = 0
         async for chunk in _generate_streaming_response(vector_results, processed_query, user_ctx_dict):
-            full_answer += chunk
+            answer_parts.append(chunk)
+            answer_length += len(chunk)
             chunk_count += 1
-            logger.info(f"[Stream] Chunk #{chunk_count}, length: {len(chunk)}, total: {len(full_answer)}")
+            logger.debug("[Stream] Chunk #%d, length: %d, total: %d", chunk_count, len(chunk), answer_length)
             yield {
                 'type': 'content',
                 'content': chunk,
                 'is_complete': False,
-                'progress': min(90, 50 + (len(full_answer) / 10))  # 动态进度
+                'progress': min(90, 50 + (answer_length / 10))  # 动态进度
             }
         
+        full_answer = "".join(answer_parts)
         logger.info("流式LLM回答生成完成")
 
         # 6. 发送完成状态
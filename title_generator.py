@@ -2,10 +2,30 @@
 聊天会话标题生成服务
 使用本地 LLM 根据用户第一条消息生成简短标题
 """
+import threading
 from langchain_ollama import ChatOllama
 from config import OLLAMA_MODEL, OLLAMA_BASE_URL
 from logging_setup import logger
 
+# 全局标题生成LLM实例，复用底层HTTP客户端的长连接
+_title_llm = None
+_title_llm_lock = threading.Lock()
+
+
+def _get_title_llm() -> ChatOllama:
+    """获取标题生成LLM实例（首次调用时创建）"""
+    global _title_llm
+    if _title_llm is None:
+        with _title_llm_lock:
+            if _title_llm is None:
+                _title_llm = ChatOllama(
+                    model=OLLAMA_MODEL,
+                    base_url=OLLAMA_BASE_URL,
+                    temperature=0.3,
+                    num_predict=50,  # 限制生成长度
+                )
+    return _title_llm
+
 
 def generate_session_title(first_message: str) -> str:
     """
@@ -29,16 +49,8 @@ def generate_session_title(first_message: str) -> str:
 
 标题："""
 
-        # 创建 LLM 实例（使用简单配置）
-        llm = ChatOllama(
-            model=OLLAMA_MODEL,
-            base_url=OLLAMA_BASE_URL,
-            temperature=0.3,
-            num_predict=50,  # 限制生成长度
-        )
-        
         # 生成标题
-        response = llm.invoke(prompt)
+        response = _get_title_llm().invoke(prompt)
         title = response.content.strip()
         
         # 如果标题太长，截取前10个字